@@ -1,10 +1,11 @@
-import glob
+import functools
 import json
 import logging
 import os
 import re
+import shlex
+import shutil
 import subprocess
-import time
 from logging.handlers import RotatingFileHandler
 
 import filelock
@@ -31,6 +32,12 @@ rclone_log_file = f"/tmp/rclone_{rc_addr}.log"
 check_after_start = 5  # 在拉起rclone进程后，休息xxs后才开始检查rclone状态，防止 rclone rc core/stats 报错退出
 check_interval = 3  # 主进程每次进行rclone rc core/stats检查的间隔
 
+# rclone 性能调优参数
+rclone_fast_list = True  # 使用 `--fast-list` 一次性递归列出目录，减少 list 请求
+# Drive pacer 参数, 为 None 时不传入, 使用 rclone 默认值 (100ms / 100), 调小容易触发 403 限流
+rclone_drive_pacer_min_sleep = None  # Drive API 请求最小间隔，如 "100ms"
+rclone_drive_pacer_burst = None  # Drive API 允许的突发请求数
+
 # rclone帐号更换监测条件
 switch_sa_level = 2  # 需要满足的规则条数，数字越大切换条件越严格，一定小于下面True（即启用）的数量，即 1 - 4(max)
 switch_sa_rules = {
@@ -63,6 +70,12 @@ logging_format = "[%(asctime)s][%(levelname)s]<%(funcName)s>: %(message)s"
 
 # ------------配置项结束------------------
 
+# 单位换算
+GiB = 1 << 30
+MiB = 1 << 20
+# 单个 SA 每日上传上限，这里是 750GB 而不是 750GiB
+SA_UPLOAD_LIMIT = 750 * 1000**3
+
 # 日志相关
 logFormatter = logging.Formatter(fmt=logging_format, datefmt=logging_datefmt)
 
@@ -88,10 +101,13 @@ consoleHandler.setFormatter(logFormatter)
 logger.addHandler(consoleHandler)
 
 
-def write_config(instance_config, name, value):
-    instance_config[name] = value
-    with open(instance_config_path, "w") as f:
-        json.dump(instance_config, f, sort_keys=True)
+def write_config(instance_config, **kwargs):
+    instance_config.update(kwargs)
+    # 先写入临时文件再替换，避免进程被杀时配置文件被截断
+    tmp_path = f"{instance_config_path}.tmp"
+    with open(tmp_path, "w") as f:
+        f.write(json.dumps(instance_config, sort_keys=True))
+    os.replace(tmp_path, instance_config_path)
 
 
 # 获得下一个Service Account Credentials JSON file path
@@ -129,23 +145,58 @@ def get_next_sa_json_path(sa_jsons, _last_sa):
 #
 
 
+# SA 文件内容不会变化，同一进程内只读取一次
+@functools.lru_cache(maxsize=None)
 def get_email_from_sa(sa):
-    return json.load(open(sa, "r"))["client_email"]
+    with open(sa, "r") as f:
+        return json.load(f)["client_email"]
+
+
+# 判断进程是否为本实例拉起的 rclone copy，避免 pid 复用时误杀 rclone mount 等进程
+def is_autorclone_proc(proc):
+    try:
+        if proc.name().find("rclone") == -1:
+            return False
+        cmdline = proc.cmdline()
+    except (psutil.NoSuchProcess, psutil.AccessDenied):
+        return False
+    if "copy" not in cmdline:
+        return False
+    if f"--rc-addr={rc_addr}" in cmdline:
+        return True
+    return any(
+        arg == "--rc-addr" and cmdline[i + 1 : i + 2] == [rc_addr]
+        for i, arg in enumerate(cmdline)
+    )
 
 
 # 强行杀掉Rclone
-def force_kill_rclone_subproc_by_parent_pid(sh_pid):
-    if psutil.pid_exists(sh_pid):
-        sh_proc = psutil.Process(sh_pid)
-        logger.info(
-            "Get The Process information - pid: %s, name: %s" % (sh_pid, sh_proc.name())
-        )
-        for child_proc in sh_proc.children():
-            if child_proc.name().find("rclone") > -1:
-                logger.info(
-                    "Force Killed rclone process which pid: %s" % child_proc.pid
-                )
-                child_proc.kill()
+def force_kill_rclone_by_pid(pid):
+    if not psutil.pid_exists(pid):
+        return
+    try:
+        proc = psutil.Process(pid)
+        logger.info("Get The Process information - pid: %s, name: %s", pid, proc.name())
+        # 旧版本通过 sh 拉起 rclone，记录的是 sh 的 pid，因此同时检查其子进程
+        candidates = [proc] + proc.children()
+    except psutil.NoSuchProcess:
+        return
+    for rclone_proc in candidates:
+        if is_autorclone_proc(rclone_proc):
+            logger.info("Force Killed rclone process which pid: %s", rclone_proc.pid)
+            try:
+                rclone_proc.kill()
+            except psutil.NoSuchProcess:
+                pass
+
+
+# 等待 rclone 进程退出，最多等待 timeout 秒，rclone 退出时立即返回
+def wait_rclone_exit(proc, timeout):
+    try:
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return False
+    return True
 
 
 def auto_rclone(src_path, dest_path, files_from=None):
@@ -153,11 +204,23 @@ def auto_rclone(src_path, dest_path, files_from=None):
     instance_config = {}
     sa_jsons = []
 
+    # 查找 rclone 可执行文件，后续直接使用其绝对路径
+    rclone_bin = shutil.which("rclone")
+    if not rclone_bin:
+        logger.error("Can't find rclone executable in PATH.")
+        return False
+
     # 单例模式
     instance_check = filelock.FileLock(instance_lock_path)
     with instance_check.acquire(timeout=0):
         # 加载account信息
-        sa_jsons = glob.glob(os.path.join(sa_json_folder, "*.json"))
+        # 排序以保证每次运行的 SA 顺序一致，`last_sa` 才能正确续接
+        with os.scandir(sa_json_folder) as it:
+            sa_jsons = sorted(
+                entry.path
+                for entry in it
+                if entry.name.endswith(".json") and entry.is_file()
+            )
         if len(sa_jsons) == 0:
             logger.error("No Service Account Credentials JSON file exists.")
             return False
@@ -174,7 +237,7 @@ def auto_rclone(src_path, dest_path, files_from=None):
             logger.debug(
                 f"Last PID {last_pid} exist, Start to check if it is still alive"
             )
-            force_kill_rclone_subproc_by_parent_pid(last_pid)
+            force_kill_rclone_by_pid(last_pid)
 
         # 对上次记录的sa信息进行检查，如果有的话，重排sa_jsons
         # 这样我们就每次都从一个新的750G开始了
@@ -184,87 +247,125 @@ def auto_rclone(src_path, dest_path, files_from=None):
             last_sa_index = sa_jsons.index(last_sa)
             sa_jsons = sa_jsons[last_sa_index:] + sa_jsons[:last_sa_index]
 
-        cmd_rclone = f'rclone copy "{src_path}" "{dest_path}" --rc --drive-server-side-across-configs -v --log-file {rclone_log_file} --rc-addr {rc_addr}'
+        # 使用参数列表直接调用 rclone，不经过 shell
+        cmd_rclone = [
+            rclone_bin,
+            "copy",
+            src_path,
+            dest_path,
+            "--rc",
+            "--drive-server-side-across-configs",
+            "-v",
+            "--log-file",
+            rclone_log_file,
+            "--rc-addr",
+            rc_addr,
+        ]
+        if rclone_drive_pacer_min_sleep is not None:
+            cmd_rclone += ["--drive-pacer-min-sleep", rclone_drive_pacer_min_sleep]
+        if rclone_drive_pacer_burst is not None:
+            cmd_rclone += ["--drive-pacer-burst", str(rclone_drive_pacer_burst)]
+        if rclone_fast_list:
+            cmd_rclone.append("--fast-list")
         if files_from:
-            cmd_rclone += f" --files-from {files_from}"
+            cmd_rclone += ["--files-from", files_from]
+
+        # 帐号切换方式只取决于配置，在循环外为每个 SA 生成好运行命令
+        if switch_sa_way == "config":
+            # switch_sa_by_config(current_sa)
+            cmd_rclone_sa = {sa: cmd_rclone for sa in sa_jsons}
+        else:
+            # 默认情况视为`runtime`，附加'--drive-service-account-file'参数
+            cmd_rclone_sa = {
+                sa: cmd_rclone + ["--drive-service-account-file", sa] for sa in sa_jsons
+            }
+        cmd_rclone_stats = [
+            rclone_bin,
+            "rc",
+            "core/stats",
+            "--url",
+            f"http://{rc_addr}",
+        ]
 
         # 帐号切换循环
         while True:
             logger.info("Switch to next SA..........")
             last_sa = current_sa = get_next_sa_json_path(sa_jsons, last_sa)
-            write_config(instance_config, "last_sa", current_sa)
             logger.info(
-                "Get SA information, file: %s , email: %s"
-                % (current_sa, get_email_from_sa(current_sa))
+                "Get SA information, file: %s , email: %s",
+                current_sa,
+                get_email_from_sa(current_sa),
             )
 
             # 切换Rclone运行命令
-            if switch_sa_way == "config":
-                # switch_sa_by_config(current_sa)
-                cmd_rclone_current_sa = cmd_rclone
-            else:
-                # 默认情况视为`runtime`，附加'--drive-service-account-file'参数
-                cmd_rclone_current_sa = (
-                    cmd_rclone + " --drive-service-account-file %s" % (current_sa,)
-                )
+            cmd_rclone_current_sa = cmd_rclone_sa[current_sa]
 
             # 起一个subprocess调rclone
-            proc = subprocess.Popen(cmd_rclone_current_sa, shell=True)
+            proc = subprocess.Popen(cmd_rclone_current_sa)
+
+            # 记录sa及pid信息，未经过 shell，此处即为 rclone 进程的 pid
+            write_config(instance_config, last_sa=current_sa, last_pid=proc.pid)
 
             # 等待，以便rclone完全起起来
             logger.info(
-                "Wait %s seconds to full call rclone command: %s"
-                % (check_after_start, cmd_rclone_current_sa)
+                "Wait %s seconds to full call rclone command: %s",
+                check_after_start,
+                shlex.join(cmd_rclone_current_sa),
             )
-            time.sleep(check_after_start)
+            wait_rclone_exit(proc, check_after_start)
 
-            # 记录pid信息
-            # 注意，因为subprocess首先起sh，然后sh再起rclone，所以此处记录的实际是sh的pid信息
-            # proc.pid + 1 在一般情况下就是rclone进程的pid，但不确定
-            # 所以一定要用 force_kill_rclone_subproc_by_parent_pid(sh_pid) 方法杀掉rclone
-            write_config(instance_config, "last_pid", proc.pid)
-            logger.info("Run Rclone command Success in pid %s" % (proc.pid + 1))
+            logger.info("Run Rclone command Success in pid %s", proc.pid)
 
             # 主进程使用 `rclone rc core/stats` 检查子进程情况
             cnt_error = 0
             cnt_403_retry = 0
             cnt_transfer_last = 0
             while True:
+                # rclone 已退出，说明本次传输已结束，无需再等待 core/stats 报错
+                if proc.poll() is not None:
+                    logger.info("Rclone exited with code %s", proc.returncode)
+                    return proc.returncode == 0
+
                 try:
-                    response = subprocess.check_output(
-                        f"rclone rc core/stats --url http://{rc_addr}", shell=True
-                    )
+                    response = subprocess.check_output(cmd_rclone_stats)
                 except subprocess.CalledProcessError:
                     cnt_error = cnt_error + 1
-                    err_msg = "check core/stats failed for %s times," % cnt_error
                     if cnt_error >= 3:
                         logger.error(
-                            err_msg + " Force kill exist rclone process %s." % proc.pid
+                            "check core/stats failed for %s times, Force kill exist rclone process %s.",
+                            cnt_error,
+                            proc.pid,
                         )
                         proc.kill()
+                        proc.wait()
                         return False
 
                     logger.warning(
-                        err_msg + " Wait %s seconds to recheck." % check_interval
+                        "check core/stats failed for %s times, Wait %s seconds to recheck.",
+                        cnt_error,
+                        check_interval,
                     )
-                    time.sleep(check_interval)
+                    wait_rclone_exit(proc, check_interval)
                     continue  # 重新检查
                 else:
                     cnt_error = 0
 
                 # 解析 `rclone rc core/stats` 输出
-                response_json = json.loads(response.decode("utf-8").replace("\0", ""))
+                # json.loads 可直接解析 bytes，仅在解析失败时才去除 `\0` 后重试
+                try:
+                    response_json = json.loads(response)
+                except ValueError:
+                    # JSONDecodeError 或开头为 `\0` 时按 UTF-16/32 解码失败的 UnicodeDecodeError
+                    response_json = json.loads(response.replace(b"\0", b""))
                 cnt_transfer = response_json.get("bytes", 0)
 
                 # 输出当前情况
                 logger.info(
-                    "Transfer Status - Upload: %s GiB, Avg upspeed: %s MiB/s, Transfered: %s, ETA: %s."
-                    % (
-                        response_json.get("bytes", 0) / pow(1024, 3),
-                        response_json.get("speed", 0) / pow(1024, 2),
-                        response_json.get("transfers", 0),
-                        response_json.get("eta", 0),
-                    )
+                    "Transfer Status - Upload: %.2f GiB, Avg upspeed: %.2f MiB/s, Transfered: %s, ETA: %s.",
+                    cnt_transfer / GiB,
+                    response_json.get("speed", 0) / MiB,
+                    response_json.get("transfers", 0),
+                    response_json.get("eta", 0),
                 )
 
                 # 判断是否应该进行切换
@@ -273,7 +374,7 @@ def auto_rclone(src_path, dest_path, files_from=None):
 
                 # 检查当前总上传是否超过 750 GB
                 if switch_sa_rules.get("up_than_750", False):
-                    if cnt_transfer > 750 * pow(1000, 3):  # 这里是 750GB 而不是 750GiB
+                    if cnt_transfer > SA_UPLOAD_LIMIT:
                         should_switch += 1
                         switch_reason += "Rule `up_than_750` hit, "
 
@@ -285,7 +386,7 @@ def auto_rclone(src_path, dest_path, files_from=None):
                         cnt_403_retry += 1
                         if cnt_403_retry % 10 == 0:
                             logger.warning(
-                                "Rclone seems not transfer in %s checks" % cnt_403_retry
+                                "Rclone seems not transfer in %s checks", cnt_403_retry
                             )
                         if cnt_403_retry >= 100:  # 超过100次检查均未增加
                             should_switch += 1
@@ -324,15 +425,15 @@ def auto_rclone(src_path, dest_path, files_from=None):
                 # 大于设置的更换级别
                 if should_switch >= switch_sa_level:
                     logger.info(
-                        "Transfer Limit may hit (%s), Try to Switch.........."
-                        % switch_reason
+                        "Transfer Limit may hit (%s), Try to Switch..........",
+                        switch_reason,
                     )
-                    force_kill_rclone_subproc_by_parent_pid(
-                        proc.pid
-                    )  # 杀掉当前rclone进程
+                    # 杀掉当前rclone进程
+                    proc.kill()
+                    proc.wait()
                     break  # 退出主进程监测循环，从而切换到下一个帐号
 
-                time.sleep(check_interval)
+                wait_rclone_exit(proc, check_interval)
 
 
 if __name__ == "__main__":
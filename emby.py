@@ -7,6 +7,7 @@ from typing import Dict, List, Optional, Sequence, Union
 import requests
 from log import logger
 from settings import EMBY_API_TOKEN, EMBY_BASE_URL
+from utils import get_http_session
 
 
 class Emby:
@@ -20,7 +21,7 @@ class Emby:
 
     @property
     def libraries(self) -> List[Dict[str, str]]:
-        res = requests.get(
+        res = get_http_session().get(
             f"{self.base_url}/Library/SelectableMediaFolders?api_key={self.token}"
         )
         if res.status_code != requests.codes.ok:
@@ -35,9 +36,13 @@ class Emby:
                 _libraries.append({"library": name, "path": path})
         return _libraries
 
-    def get_library_by_location(self, path: str) -> Optional[str]:
+    def get_library_by_location(
+        self, path: str, libraries: Optional[List[Dict[str, str]]] = None
+    ) -> Optional[str]:
         """通过路径获取库"""
-        for lib in self.libraries:
+        if libraries is None:
+            libraries = self.libraries
+        for lib in libraries:
             if path.startswith(lib.get("path")):
                 return lib.get("library")
         return None
@@ -46,12 +51,15 @@ class Emby:
         """发送扫描请求"""
         if isinstance(path, str):
             path = [path]
-        _path = set(path)
+        # libraries 每次访问都会请求接口, 每次扫描只获取一次
+        libraries = self.libraries
+        _path = set()
         for p in set(path):
-            lib = self.get_library_by_location(p)
+            lib = self.get_library_by_location(p, libraries=libraries)
             if not lib:
                 logger.warning(f"Warning: library not found for {p}")
-                _path.remove(p)
+                continue
+            _path.add(p)
         if not _path:
             return
 
@@ -61,7 +69,7 @@ class Emby:
 
         while True:
             try:
-                res = requests.post(
+                res = get_http_session().post(
                     url=f"{self.base_url}/Library/Media/Updated?api_key={self.token}",
                     data=json.dumps(payload),
                     headers=headers,
@@ -5,12 +5,10 @@ import re
 import shutil
 import textwrap
 import traceback
-from copy import deepcopy
 from time import sleep
 from typing import Union
 
 import anitopy
-from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from emby import Emby
 from log import logger
 from plex import Plex
@@ -20,6 +18,49 @@ from tmdb import TMDB
 from utils import is_filename_length_gt_255
 
 DEFAULT_EPISODE_REGEX = r"[ep](\d{2,4})(?!\d)"
+SUBTITLE_SUFFIX = frozenset({"srt", "ass", "ssa", "sup"})
+# 需要保留的文件后缀, 统一小写
+KEEP_FILE_SUFFIX = frozenset(suffix.lower() for suffix in MEDIA_SUFFIX)
+KEEP_FILE_SUFFIX_WITH_NFO = KEEP_FILE_SUFFIX | {"nfo"}
+# 剧集原先按子串匹配 "ts", 会保留 m2ts/mts 原盘流, 改为精确匹配后显式保留
+TVSHOW_KEEP_FILE_SUFFIX = KEEP_FILE_SUFFIX | {"m2ts", "mts"}
+TVSHOW_KEEP_FILE_SUFFIX_WITH_NFO = TVSHOW_KEEP_FILE_SUFFIX | {"nfo"}
+
+# 逐文件处理时使用的正则, 预先编译
+SUBTITLE_LANG_RE = re.compile(r"[-\.](ch[st]|[st]c)", re.IGNORECASE)
+RESOLUTION_RE = re.compile(r"(\d{3,4}[pi])(?!\d)", re.IGNORECASE)
+MEDIUM_RE = re.compile(
+    r"UHD|remux|(?:blu-?ray)|web-?dl|dvdrip|web-?rip|[HI]MAX", re.IGNORECASE
+)
+FRAME_RE = re.compile(r"\d{2,3}fps", re.IGNORECASE)
+WEB_SOURCE_RE = re.compile(
+    r"[\.\s](Disney\+|DSNP|NF|Fri(day)?|AMZN|MyTVS(uper)?|TVB|Bili(bili)?|Baha|GagaOOLala|Hami|Netflix|Viu|Viki|TVING|KKTV|G-Global|HBO|Hulu|Paramount+|iTunes|CatchPlay|IQ)[\.\s]",
+    re.IGNORECASE,
+)
+CODEC_RE = re.compile(
+    r"x264|x265|HEVC|h\.?265|h\.?264|10bit|[HS]DR|HQ|HBR|DV|DoVi(?=[\s\.])",
+    re.IGNORECASE,
+)
+AUDIO_RE = re.compile(
+    r"AAC|AC3|DTS(?:-HD)?|FLAC|MA(?:\.[57]\.1)?|2[Aa]udio|TrueHD|Atmos|DDP"
+)
+VERSION_RE = re.compile(
+    r"[\.\s\[](v\d|Remastered|REPACK|PROPER|Extended( Edition)?(?!(.*Cut))|CC|DC|CEE|Criterion Collection|BFI|Directors\.Cut|Fan Cut|Uncut|ProRes)[\.\s\]]",
+    re.IGNORECASE,
+)
+GROUP_NOISE_RE = re.compile(r"(web-dl|dts-hd|blu-ray|-10bit|dts-x)", re.IGNORECASE)
+GROUP_SEP_RE = re.compile(r"[-@]")
+TMDB_ID_RE = re.compile(r"tmdb-(\d+)")
+TMDB_NAME_RE = re.compile(r".*{tmdb-\d+}")
+NAME_YEAR_RE = re.compile(r"^((.+?)[\s\.](\d{4})[\.\s])(?!\d{4}[\s\.])")
+CN_NAME_RE = re.compile(
+    r"\[?([\u4e00-\u9fa5]+.*?[\u4e00-\u9fa5]*?)\]? (?![\u4e00-\u9fa5]+)(.+)$"
+)
+SEASON_RE = re.compile(r"S(eason)?\s?(\d{1,2})")
+SEASON_NFO_RE = re.compile(r"(season|tvshow)\.nfo")
+SEASON_NUMBER_RE = re.compile(r"S\d{2}")
+SEASON_EPISODE_RE = re.compile(r"S\d{2}E(\d+)")
+EPISODE_RE = re.compile(r"E(\d+)")
 
 
 def parse():
@@ -60,12 +101,11 @@ def media_filename_pre_handle(parent_dir_path, filename):
     filepath = os.path.join(parent_dir_path, filename)
 
     # split file name into parts
-    file_parts = filename.split(".")
-    filename_pre, filename_suffix = ".".join(file_parts[0:-1]), file_parts[-1]
+    filename_pre, _, filename_suffix = filename.rpartition(".")
 
     # deal with subtitles
-    if filename_suffix.lower() in ["srt", "ass", "ssa", "sup"]:
-        lang_match = re.search(r"[-\.](ch[st]|[st]c)", filename_pre, re.IGNORECASE)
+    if filename_suffix.lower() in SUBTITLE_SUFFIX:
+        lang_match = SUBTITLE_LANG_RE.search(filename_pre)
         filename_suffix = "zh." + filename_suffix
         if lang_match:
             filename_suffix = lang_match.group(1) + "." + filename_suffix
@@ -116,55 +156,28 @@ def get_media_info_from_filename(
 
     # get resolution of video
     try:
-        resolution = re.search(
-            r"(\d{3,4}[pi])(?!\d)", filename_pre, re.IGNORECASE
-        ).group(1)
+        resolution = RESOLUTION_RE.search(filename_pre).group(1)
     except Exception:
         resolution = ""
     # get medium of video
-    medium = set(
-        re.findall(
-            r"UHD|remux|(?:blu-?ray)|web-?dl|dvdrip|web-?rip|[HI]MAX",
-            filename_pre,
-            re.IGNORECASE,
-        )
-    )
+    medium = set(MEDIUM_RE.findall(filename_pre))
     # get frame rate of video
     try:
-        frame = re.search(r"\d{2,3}fps", filename_pre, re.IGNORECASE).group(0)
+        frame = FRAME_RE.search(filename_pre).group(0)
     except Exception:
         frame = ""
     # get web-dl source
     try:
-        web_source = re.search(
-            r"[\.\s](Disney\+|DSNP|NF|Fri(day)?|AMZN|MyTVS(uper)?|TVB|Bili(bili)?|Baha|GagaOOLala|Hami|Netflix|Viu|Viki|TVING|KKTV|G-Global|HBO|Hulu|Paramount+|iTunes|CatchPlay|IQ)[\.\s]",
-            filename_pre,
-            re.I,
-        ).group(1)
+        web_source = WEB_SOURCE_RE.search(filename_pre).group(1)
     except Exception:
         web_source = ""
     # get codec of video
-    codec = set(
-        re.findall(
-            r"x264|x265|HEVC|h\.?265|h\.?264|10bit|[HS]DR|HQ|HBR|DV|DoVi(?=[\s\.])",
-            filename_pre,
-            re.IGNORECASE,
-        )
-    )
+    codec = set(CODEC_RE.findall(filename_pre))
     # get audio of video
-    audio = set(
-        re.findall(
-            r"AAC|AC3|DTS(?:-HD)?|FLAC|MA(?:\.[57]\.1)?|2[Aa]udio|TrueHD|Atmos|DDP",
-            filename_pre,
-        )
-    )
+    audio = set(AUDIO_RE.findall(filename_pre))
     # get version
     try:
-        version = re.search(
-            r"[\.\s\[](v\d|Remastered|REPACK|PROPER|Extended( Edition)?(?!(.*Cut))|CC|DC|CEE|Criterion Collection|BFI|Directors\.Cut|Fan Cut|Uncut|ProRes)[\.\s\]]",
-            filename_pre,
-            re.IGNORECASE,
-        ).group(1)
+        version = VERSION_RE.search(filename_pre).group(1)
     except Exception:
         version = ""
     else:
@@ -176,15 +189,7 @@ def get_media_info_from_filename(
         if group:
             _group = group
         else:
-            _group_split = re.split(
-                r"[-@]",
-                re.sub(
-                    r"(web-dl|dts-hd|blu-ray|-10bit|dts-x)",
-                    " ",
-                    filename_pre,
-                    flags=re.IGNORECASE,
-                ),
-            )
+            _group_split = GROUP_SEP_RE.split(GROUP_NOISE_RE.sub(" ", filename_pre))
             if len(_group_split) == 2:
                 _group = _group_split[-1]
             elif len(_group_split) == 3:
@@ -226,17 +231,13 @@ def get_plex_edition_from_version(version: str) -> str:
 
 
 def rename_media(old_path, new_path, dryrun=False, replace=True):
-    if os.path.exists(new_path):
-        if not replace:
-            logger.warning(f"{os.path.basename(new_path)} exists in {new_path}")
-            return True
-        else:
-            logger.info(f"Removing existed file {new_path}")
-            if not dryrun:
-                os.remove(new_path)
+    if not replace and os.path.exists(new_path):
+        logger.warning(f"{os.path.basename(new_path)} exists in {new_path}")
+        return True
     if not dryrun:
         os.makedirs(os.path.dirname(new_path), exist_ok=True)
-        os.rename(old_path, new_path)
+        # os.replace 会原子地覆盖已存在的文件, 无需先删除
+        os.replace(old_path, new_path)
     logger.info(old_path + " --> " + new_path)
 
     return True
@@ -244,29 +245,35 @@ def rename_media(old_path, new_path, dryrun=False, replace=True):
 
 def remove_hidden_files(root_dir_path, dryrun=False):
     removed_files = []
-    for file in os.listdir(root_dir_path):
-        if file.startswith("."):
-            removed_files.append((file, 1 if os.path.isdir(file) else 0))
+    with os.scandir(root_dir_path) as it:
+        for entry in it:
+            if not entry.name.startswith("."):
+                continue
+            is_dir = entry.is_dir(follow_symlinks=False)
+            removed_files.append((entry.name, 1 if is_dir else 0))
             if not dryrun:
-                os.remove(os.path.join(root_dir_path, file))
-            logger.info("Removed hidden file: " + os.path.join(root_dir_path, file))
+                if is_dir:
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+            logger.info("Removed hidden file: " + entry.path)
     return removed_files
 
 
 def remove_small_files(root_dir_path, threshold=128 * 1024 * 1024, dryrun=False):
-    for file in os.listdir(root_dir_path):
-        filepath = os.path.join(root_dir_path, file)
-        if os.path.isfile(filepath):
-            size = os.path.getsize(filepath)
-            if size < threshold:
-                if not dryrun:
-                    os.remove(filepath)
-                logger.info("Removed file: " + filepath + f", size {size}")
+    with os.scandir(root_dir_path) as it:
+        for entry in it:
+            if entry.is_file():
+                size = entry.stat().st_size
+                if size < threshold:
+                    if not dryrun:
+                        os.remove(entry.path)
+                    logger.info("Removed file: " + entry.path + f", size {size}")
 
 
 def query_tmdb_id(name, media_type):
     # check if name has tmdb
-    tmdb_id_match = re.search(r"tmdb-(\d+)", name)
+    tmdb_id_match = TMDB_ID_RE.search(name)
     if tmdb_id_match:
         return tmdb_id_match.group(1)
     is_movie = True if media_type == "movie" else False
@@ -274,7 +281,7 @@ def query_tmdb_id(name, media_type):
     tmdb = TMDB(movie=is_movie)
     tmdb_id = None
     if media_type != "anima":
-        match = re.search(r"^((.+?)[\s\.](\d{4})[\.\s])(?!\d{4}[\s\.])", name)
+        match = NAME_YEAR_RE.search(name)
         if not match:
             logger.error(f"Failed to get correct formatted name: {name}")
             raise
@@ -284,10 +291,7 @@ def query_tmdb_id(name, media_type):
         name = anitopy.parse(name).get("anime_title")
         year = anitopy.parse(name).get("anime_title")
 
-    cn_match = re.match(
-        r"\[?([\u4e00-\u9fa5]+.*?[\u4e00-\u9fa5]*?)\]? (?![\u4e00-\u9fa5]+)(.+)$",
-        name,
-    )
+    cn_match = CN_NAME_RE.match(name)
 
     if cn_match:
         # 分别用中文和英文进行查询
@@ -351,8 +355,13 @@ def handle_tvshow(
     year = details.get("year")
     month = details.get("month")
 
+    keep_file_suffix = (
+        TVSHOW_KEEP_FILE_SUFFIX_WITH_NFO if keep_nfo else TVSHOW_KEEP_FILE_SUFFIX
+    )
     # 用于记录处理的文件数量,如果为 0,则认为为空文件夹
     handled_files = 0
+    # 已确认存在 .plexmatch 的目录, 同一季的剧集无需重复检查
+    plexmatch_dirs = set()
     # workaround: 由于可能出现 os.walk 无内容的情况，暂时增加重试次数来规避下
     retry = 3
     while retry > 0:
@@ -366,26 +375,22 @@ def handle_tvshow(
                     dir, file
                 )
                 # remove unuseful files
-                keep_file_suffix = deepcopy(MEDIA_SUFFIX)
-                if keep_nfo:
-                    keep_file_suffix.append("nfo")
-                if not re.search(
-                    r"|".join(keep_file_suffix), filename_suffix, re.IGNORECASE
-                ):
+                # 字幕的 filename_suffix 带有语言前缀 (如 zh.srt), 取最后一段判断
+                if filename_suffix.rpartition(".")[2].lower() not in keep_file_suffix:
                     if not dryrun:
                         os.remove(filepath)
                     logger.info("Removed file: " + filepath)
                     continue
 
                 # remove season.nfo/tvshow.nfo
-                if re.search(r"(season|tvshow)\.nfo", file):
+                if SEASON_NFO_RE.search(file):
                     if not dryrun:
                         os.remove(filepath)
                     logger.info(f"Removed file: {filepath}")
                     continue
 
                 if not season:
-                    season_match = re.search(r"S(eason)?\s?(\d{1,2})", dir + file)
+                    season_match = SEASON_RE.search(dir + file)
                     if not season_match:
                         raise Exception(f"Not found season number: {dir + file}")
                     _season = season_match.group(2)
@@ -400,19 +405,19 @@ def handle_tvshow(
 
                 handled_files += 1
                 # 原文件中已经包含 tmdb id
-                if re.search(r"tmdb-\d+", file):
+                if TMDB_ID_RE.search(file):
                     # 替换 tmdb name
-                    new_filename = re.sub(r".*{tmdb-\d+}", tmdb_name, file)
+                    new_filename = TMDB_NAME_RE.sub(tmdb_name, file)
                     # 替换 season number
-                    new_filename = re.sub(
-                        r"S\d{2}", f"S{_season}", new_filename, count=1
+                    new_filename = SEASON_NUMBER_RE.sub(
+                        f"S{_season}", new_filename, count=1
                     )
                     # 替换 episode
                     if offset:
-                        episode = re.search(r"S\d{2}E(\d+)", new_filename).group(1)
+                        episode = SEASON_EPISODE_RE.search(new_filename).group(1)
                         episode = str(int(episode) - int(offset)).zfill(len(episode))
-                        new_filename = re.sub(
-                            r"E(\d+)", f"E{episode}", new_filename, count=1
+                        new_filename = EPISODE_RE.sub(
+                            f"E{episode}", new_filename, count=1
                         )
                     if new_filename == file and not force:
                         logger.warning(f"{file}'s name does not change, skipping...")
@@ -479,21 +484,27 @@ def handle_tvshow(
                 new_dir = os.path.join(new_media_dir, f"Season {_season}")
                 new_file_path = os.path.join(new_dir, new_filename)
                 if dst_path != media_path and not dryrun:
-                    if not os.path.exists(os.path.join(new_dir, ".plexmatch")):
-                        add_plexmatch_file(
-                            new_dir,
-                            details.get("title"),
-                            year=year,
-                            tmdb_id=tmdb_id,
-                            season=int(_season),
-                        )
-                    if not os.path.exists(os.path.join(new_media_dir, ".plexmatch")):
-                        add_plexmatch_file(
-                            new_media_dir,
-                            details.get("title"),
-                            year=year,
-                            tmdb_id=tmdb_id,
-                        )
+                    if new_dir not in plexmatch_dirs:
+                        if not os.path.exists(os.path.join(new_dir, ".plexmatch")):
+                            add_plexmatch_file(
+                                new_dir,
+                                details.get("title"),
+                                year=year,
+                                tmdb_id=tmdb_id,
+                                season=int(_season),
+                            )
+                        plexmatch_dirs.add(new_dir)
+                    if new_media_dir not in plexmatch_dirs:
+                        if not os.path.exists(
+                            os.path.join(new_media_dir, ".plexmatch")
+                        ):
+                            add_plexmatch_file(
+                                new_media_dir,
+                                details.get("title"),
+                                year=year,
+                                tmdb_id=tmdb_id,
+                            )
+                        plexmatch_dirs.add(new_media_dir)
                     scan_folders.append(new_dir)
                     logger.debug(f"Added scan folder: {new_dir}")
 
@@ -537,6 +548,9 @@ def handle_movie(
     # 初始化 tmdb
     tmdb_name = ""
     tmdb = TMDB(movie=True)
+    # 已确认存在 .plexmatch 的目录
+    plexmatch_dirs = set()
+    keep_file_suffix = KEEP_FILE_SUFFIX_WITH_NFO if keep_nfo else KEEP_FILE_SUFFIX
 
     for dir, subdir, files in os.walk(media_path):
         removed_files = remove_hidden_files(dir, dryrun=dryrun)
@@ -556,11 +570,9 @@ def handle_movie(
             (filepath, filename_pre, filename_suffix) = media_filename_pre_handle(
                 dir, filename
             )
-            keep_file_suffix = deepcopy(MEDIA_SUFFIX)
-            if keep_nfo:
-                keep_file_suffix.append("nfo")
             # remove unuseful files
-            if filename_suffix.lower() not in keep_file_suffix:
+            # 字幕的 filename_suffix 带有语言前缀 (如 zh.srt), 取最后一段判断
+            if filename_suffix.rpartition(".")[2].lower() not in keep_file_suffix:
                 if not dryrun:
                     os.remove(filepath)
                 logger.info("Removed file: " + filepath)
@@ -578,8 +590,8 @@ def handle_movie(
             year = details.get("year")
             month = details.get("month")
 
-            if re.search(r"tmdb-\d+", filename):
-                new_filename = re.sub(r".*{tmdb-\d+}", tmdb_name, filename)
+            if TMDB_ID_RE.search(filename):
+                new_filename = TMDB_NAME_RE.sub(tmdb_name, filename)
                 if new_filename == filename and not force:
                     logger.warning(f"{filename}'s name does not change, skipping...")
                     continue
@@ -630,10 +642,12 @@ def handle_movie(
             new_dir = os.path.join(dst_path, f"Released_{year}", f"M{month}", tmdb_name)
             new_file_path = os.path.join(new_dir, new_filename)
             if dst_path != media_path and not dryrun:
-                if not os.path.exists(os.path.join(new_dir, ".plexmatch")):
-                    add_plexmatch_file(
-                        new_dir, details.get("title"), year=year, tmdb_id=_tmdb_id
-                    )
+                if new_dir not in plexmatch_dirs:
+                    if not os.path.exists(os.path.join(new_dir, ".plexmatch")):
+                        add_plexmatch_file(
+                            new_dir, details.get("title"), year=year, tmdb_id=_tmdb_id
+                        )
+                    plexmatch_dirs.add(new_dir)
                 scan_folders.append(new_dir)
                 logger.debug(f"Added scan folder: {new_dir}")
             rename_media(os.path.join(dir, filename), new_file_path, dryrun=dryrun)
@@ -677,14 +691,15 @@ def handle_local_media(
             media_type = "av"
 
         path = os.path.join(root, folder)
-        media_folders = [
-            os.path.join(path, p)
-            for p in os.listdir(path)
-            if os.path.isdir(os.path.join(path, p))
-            and not (ignore_filter and re.search(ignore_filter, p))
-        ]
+        with os.scandir(path) as it:
+            media_folders = [
+                entry.path
+                for entry in it
+                if entry.is_dir()
+                and not (ignore_filter and re.search(ignore_filter, entry.name))
+            ]
         for media_folder in media_folders:
-            tmdb_name = re.search(r"tmdb-(\d+)", media_folder)
+            tmdb_name = TMDB_ID_RE.search(media_folder)
             try:
                 if tmdb_name:
                     tmdb_id = tmdb_name.group(1)
@@ -720,12 +735,26 @@ def handle_local_media(
                 logger.info(f"Processed {media_folder}")
 
 
+def merge_scan_folders(scan_folders) -> list:
+    """合并扫描路径, 已被其他路径包含的子路径无需单独扫描"""
+    merged = []
+    # 按路径层级排序, 保证子路径紧跟在其父路径之后
+    for folder in sorted(
+        {folder.rstrip("/") for folder in scan_folders}, key=lambda f: f.split("/")
+    ):
+        if merged and folder.startswith(merged[-1] + "/"):
+            continue
+        merged.append(folder)
+    return merged
+
+
 def send_scan_request(
     scan_folders: Union[str, list, tuple], plex=PLEX_AUTO_SCAN, emby=EMBY_AUTO_SCAN
 ):
     # handle scan request
     if not isinstance(scan_folders, (list, tuple)):
         scan_folders = [scan_folders]
+    scan_folders = merge_scan_folders(scan_folders)
     media_servers = []
     if plex:
         _plex = Plex()
@@ -736,7 +765,7 @@ def send_scan_request(
     for server in media_servers:
         while True:
             try:
-                server.scan(path=set(scan_folders))
+                server.scan(path=scan_folders)
             except Exception as e:
                 logger.error(f"Send scan request failed due to: {e}")
                 logger.error(traceback.format_exc())
@@ -845,10 +874,8 @@ def media_handle(
         # 120s 后执行, 尽量避免 rclone 未更新导致路径找不到
         run_date = datetime.datetime.now() + datetime.timedelta(minutes=3)
         scheduler = Scheduler()
-        if keep_job_persisted and not scheduler.jobstores.get("sqlite"):
-            scheduler.add_jobstore(
-                SQLAlchemyJobStore(url="sqlite:///jobs.sql"), alias="sqlite"
-            )
+        if keep_job_persisted:
+            scheduler.enable_persistence()
         scheduler.add_job(
             send_scan_request,
             args=(scan_folders,),
@@ -881,9 +908,4 @@ if __name__ == "__main__":
         force=args.force,
     )
 
-    scheduler = Scheduler()
-    while True:
-        if not scheduler.scheduler.get_jobs():
-            break
-        sleep(30)
-    sleep(30)
+    Scheduler().wait_for_jobs()
@@ -2,16 +2,21 @@ import argparse
 import datetime
 import json
 import os
-import pickle
 import re
 import traceback
 from pathlib import Path
-from time import sleep
 
 from log import logger
-from media_handle import add_plexmatch_file, rename_media, send_scan_request
+from media_handle import (
+    SEASON_RE,
+    TMDB_ID_RE,
+    add_plexmatch_file,
+    rename_media,
+    send_scan_request,
+)
 from scheduler import Scheduler
 from tmdb import TMDB
+from utils import dump_pickle, load_pickle
 
 
 def parse():
@@ -31,11 +36,7 @@ def main(root_folder, media_type="movie", ignore_filter=None):
     scheduler = Scheduler()
     fails = {}
     cache_path = Path("tmdb_info.cache")
-    if cache_path.exists():
-        with open(cache_path, "rb") as f:
-            cache = pickle.load(f)
-    else:
-        cache = {}
+    cache = load_pickle(cache_path, default={})
     try:
         for root_path, dirs, files in os.walk(root_folder):
             if ignore_filter and re.search(rf"{ignore_filter}", root_path):
@@ -47,7 +48,8 @@ def main(root_folder, media_type="movie", ignore_filter=None):
                 if file.startswith("."):
                     continue
                 filepath = Path(root_path, file)
-                tmdbid_match = re.search(r"tmdb-(\d+)", str(filepath))
+                filepath_str = str(filepath)
+                tmdbid_match = TMDB_ID_RE.search(filepath_str)
                 if not tmdbid_match:
                     continue
                 try:
@@ -67,9 +69,7 @@ def main(root_folder, media_type="movie", ignore_filter=None):
                         root_folder, f"{prefix}_{year}", f"M{month}", tmdb_name
                     )
                     if not is_movie:
-                        season_match = re.search(
-                            r"S(eason)?\s?(\d{1,2})", str(filepath)
-                        )
+                        season_match = SEASON_RE.search(filepath_str)
                         if season_match:
                             season = season_match.group(2).zfill(2)
                             new_folder = new_folder / f"Season {season}"
@@ -79,11 +79,11 @@ def main(root_folder, media_type="movie", ignore_filter=None):
                         if new_filepath.exists():
                             logger.info(f"{new_filepath} exists, skipping")
                             continue
-                        rename_media(str(filepath), str(new_filepath))
+                        rename_media(filepath_str, str(new_filepath))
                 except Exception as e:
                     logger.error(e)
                     logger.error(traceback.format_exc())
-                    fails.update({str(filepath): str(e)})
+                    fails.update({filepath_str: str(e)})
                     continue
                 else:
                     plex_match_file = new_folder / ".plexmatch"
@@ -112,17 +112,12 @@ def main(root_folder, media_type="movie", ignore_filter=None):
         logger.error(e)
         logger.error(traceback.format_exc())
     finally:
-        with open(cache_path, "wb") as f:
-            pickle.dump(cache, f)
+        dump_pickle(cache, cache_path)
 
         with open("mv_failed.json", "a+") as f:
             json.dump(fails, f)
 
-        while True:
-            if not scheduler.scheduler.get_jobs():
-                break
-            sleep(30)
-        sleep(60)
+        scheduler.wait_for_jobs()
 
 
 def scan_folder():
@@ -147,11 +142,7 @@ def scan_folder():
                         f"Added scheduler job: next run at {str(run_date)}, folder: {str(__dir.absolute())}"
                     )
 
-    while True:
-        if not scheduler.scheduler.get_jobs():
-            break
-        sleep(30)
-    sleep(60)
+    scheduler.wait_for_jobs()
 
 
 if __name__ == "__main__":
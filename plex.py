@@ -8,16 +8,24 @@ from log import logger
 from plexapi.myplex import Section
 from plexapi.server import PlexServer
 from settings import PLEX_API_TOKEN, PLEX_BASE_URL
+from utils import Singleton
 
 
-class Plex:
-    """class Plex"""
+class Plex(metaclass=Singleton):
+    """class Plex
+
+    单例, 所有扫描任务复用同一个 PlexServer 连接
+    """
 
     def __init__(self, base_url: str = PLEX_BASE_URL, token: str = PLEX_API_TOKEN):
         self.plex_server = PlexServer(baseurl=base_url, token=token)
 
-    def get_section_by_location(self, location: str) -> Optional[Section]:
-        for section in self.plex_server.library.sections():
+    def get_section_by_location(
+        self, location: str, sections: Optional[Sequence[Section]] = None
+    ) -> Optional[Section]:
+        if sections is None:
+            sections = self.plex_server.library.sections()
+        for section in sections:
             for loc in section.locations:
                 if re.search(rf"{loc}", location):
                     return section
@@ -39,16 +47,19 @@ class Plex:
         """发送扫描请求"""
         if isinstance(path, str):
             path = [path]
-        _path = set(path)
+        # 每次扫描只获取一次 sections
+        sections = self.plex_server.library.sections()
+        _path = {}
         for p in set(path):
-            section = self.get_section_by_location(p)
+            section = self.get_section_by_location(p, sections=sections)
             if not section:
-                logger.error("Section Not found")
-                _path.remove(p)
+                logger.error(f"Section Not found: {p}")
+                continue
+            _path[p] = section
         if not _path:
             return False
 
-        for p in _path:
+        for p, section in _path.items():
             while True:
                 try:
                     section.update(p)
@@ -57,7 +68,7 @@ class Plex:
                     sleep(10)
                     continue
                 else:
-                    logger.info(f"Sent scan request successfully: {path}")
+                    logger.info(f"Sent scan request successfully: {p}")
                     break
 
     def refresh_recently_added(self, path: str, max: int = 10):
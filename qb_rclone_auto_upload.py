@@ -6,7 +6,6 @@
 
 import argparse
 import os
-import pickle
 import re
 import subprocess
 import time
@@ -18,7 +17,7 @@ import anitopy
 import qbittorrentapi
 from autorclone import auto_rclone
 from log import logger
-from media_handle import handle_local_media, media_handle
+from media_handle import CN_NAME_RE, NAME_YEAR_RE, handle_local_media, media_handle
 from settings import (
     CATEGORY_SETTINGS_MAPPING,
     HANDLE_LOCAL_MEDIA,
@@ -29,10 +28,29 @@ from settings import (
 )
 from tmdb import TMDB
 from tmdbv3api.exceptions import TMDbException
-from utils import dump_json, load_json, remove_empty_folder, send_tg_msg, sumarize_tags
+from utils import (
+    dump_json,
+    dump_pickle,
+    get_category_settings,
+    load_json,
+    load_pickle,
+    remove_empty_folder,
+    send_tg_msg,
+    sumarize_tags,
+)
 
 script_path = os.path.split(os.path.realpath(__file__))[0]
 
+# 每个种子都会用到的正则, 预先编译
+NAME_RESOLUTION_RE = re.compile(r"^(.+?)[\s\.](\d{3,4}[Pp])")
+NAME_SEASON_SUFFIX_RE = re.compile(r"[\.\s][sS]\d{1,2}[\.\s]?$")
+NAME_SEASON_RE = re.compile(r"[\.\s]S(\d{2})[\s\.Ee]")
+YEAR_TAG_RE = re.compile(r"Y(\d{4})")
+OFFSET_TAG_RE = re.compile(r"O(-?\d+)")
+SEASON_TAG_RE = re.compile(r"S(\d{2})")
+TMDB_ID_TAG_RE = re.compile(r"T(\d+)")
+TMDB_NAME_YEAR_RE = re.compile(r"\s\((\d{4})\)\s")
+
 
 def parse():
     parser = argparse.ArgumentParser(description="qBittorrent Auto Rclone")
@@ -71,6 +89,8 @@ def main(src_dir=""):
     # current uuid
     uuid = os.urandom(16).hex()
 
+    media_info_file_path = os.path.join(script_path, "media_info.cache")
+
     # retrieve torrents filtered by tag
     while True:
         try:
@@ -80,6 +100,9 @@ def main(src_dir=""):
             except Exception:
                 to_handle = {}
 
+            # get media info, 每轮只读取一次, 修改后仍按种子即时持久化
+            media_info: dict = load_pickle(media_info_file_path, default={})
+
             for torrent in qbt_client.torrents_info():
                 if torrent.progress == 1 or torrent.state in ["uploading", "forcedUP"]:
                     # workaround：跳过刚完成少于 1min 的种子
@@ -92,7 +115,7 @@ def main(src_dir=""):
                     if "" in tags:
                         tags.remove("")
                     category = torrent.category
-                    if re.search(r"NSFW", category):
+                    if "NSFW" in category:
                         tags.append("no_seed")
 
                     # process torrents added by MoviePilot
@@ -136,51 +159,33 @@ def main(src_dir=""):
                             )
                         continue
 
-                    # get media info
-                    media_info_file_path = os.path.join(script_path, "media_info.cache")
-                    if os.path.exists(media_info_file_path):
-                        with open(media_info_file_path, "rb") as f:
-                            media_info: dict = pickle.load(f)
-                    else:
-                        media_info = {}
-
                     # get media title
-                    if re.search(r"Anime", category):
+                    if "Anime" in category:
                         parse_rslt = anitopy.parse(torrent.name)
                         name = parse_rslt.get("anime_title")
                     else:
-                        torrent_name_match = re.search(
-                            r"^((.+?)[\s\.](\d{4})[\.\s])(?!\d{4}[\s\.])", torrent.name
-                        )
+                        torrent_name_match = NAME_YEAR_RE.search(torrent.name)
                         # not matched
                         if not torrent_name_match:
                             # todo: 未匹配到年份时,也进行一次匹配查询
                             try:
-                                name = re.search(
-                                    r"^(.+?)[\s\.](\d{3,4}[Pp])", torrent.name
-                                ).group(1)
+                                name = NAME_RESOLUTION_RE.search(torrent.name).group(1)
                             except Exception:
                                 name = torrent.name
                         # matched year in torrent name
                         else:
                             name = " ".join(
-                                re.sub(
-                                    r"[\.\s][sS]\d{1,2}[\.\s]?$",
-                                    " ",
-                                    torrent_name_match.group(2),
+                                NAME_SEASON_SUFFIX_RE.sub(
+                                    " ", torrent_name_match.group(2)
                                 )
                                 .strip(".")
                                 .split(".")
                             )
 
                     # flag
-                    is_movie = (
-                        True if re.search(r"Movies|Concerts", category) else False
-                    )
-                    is_nc17 = True if re.search(r"NC17-Movies", category) else False
-                    query_flag = (
-                        True if not re.search(r"NSFW|Music", category) else False
-                    )
+                    is_movie = "Movies" in category or "Concerts" in category
+                    is_nc17 = "NC17-Movies" in category
+                    query_flag = not ("NSFW" in category or "Music" in category)
                     if "no_query" in tags:
                         query_flag = False
 
@@ -197,8 +202,7 @@ def main(src_dir=""):
                             )
                         if "end" in tags and name in media_info:
                             media_info.pop(name)
-                            with open(media_info_file_path, "wb") as f:
-                                pickle.dump(media_info, f)
+                            dump_pickle(media_info, media_info_file_path)
                             # add ignore tag
                             qbt_client.torrents_add_tags(
                                 tags="ignore", torrent_hashes=torrent.hash
@@ -248,25 +252,24 @@ def main(src_dir=""):
 
                         season = ""
                         # get year from tag
-                        year_tag = re.search(r"Y(\d{4})", ", ".join(tags))
+                        tags_str = ", ".join(tags)
+                        year_tag = YEAR_TAG_RE.search(tags_str)
                         year = int(year_tag.group(1)) if year_tag else None
                         # get episode offset from tag
-                        offset_tag = re.search(r"O(-?\d+)", ", ".join(tags))
+                        offset_tag = OFFSET_TAG_RE.search(tags_str)
                         offset = int(offset_tag.group(1)) if offset_tag else 0
                         # get season info for tvshows
-                        if re.search(r"TVShows|Anime", category):
+                        if "TVShows" in category or "Anime" in category:
                             # get season info from ", ".join(tags)
-                            rslt = re.search(r"S(\d{2})", ", ".join(tags))
+                            rslt = SEASON_TAG_RE.search(tags_str)
                             if rslt:
                                 season = rslt.group(1)
                             else:
                                 # get season info from torrent name
-                                season_match = re.search(
-                                    r"[\.\s]S(\d{2})[\s\.Ee]", torrent.name
-                                )
+                                season_match = NAME_SEASON_RE.search(torrent.name)
                                 season = season_match.group(1) if season_match else ""
                         # get tmdb_id from tag
-                        tmdb_id_tag = re.search(r"T(\d+)", ", ".join(tags))
+                        tmdb_id_tag = TMDB_ID_TAG_RE.search(tags_str)
                         tmdb_id = tmdb_id_tag.group(1) if tmdb_id_tag else tmdb_id
 
                         # tmdb 与记录中 tmdb 一致，直接用之前的 tmdb_name
@@ -334,10 +337,7 @@ def main(src_dir=""):
                                         year = torrent_name_match.group(3)
 
                                     # rename if there is chinese
-                                    cn_match = re.match(
-                                        r"\[?([\u4e00-\u9fa5]+.*?[\u4e00-\u9fa5]*?)\]? (?![\u4e00-\u9fa5]+)(.+)$",
-                                        name,
-                                    )
+                                    cn_match = CN_NAME_RE.match(name)
                                     if cn_match:
                                         if query_flag:
                                             if not local_record:
@@ -445,7 +445,7 @@ def main(src_dir=""):
                             )
                             continue
                         # add season info for tvshows
-                        if re.search(r"TVShows|Anime", category) and season:
+                        if ("TVShows" in category or "Anime" in category) and season:
                             save_name = save_name + "/" + f"Season {season.zfill(2)}"
 
                         # get certification info for movie
@@ -454,9 +454,9 @@ def main(src_dir=""):
                             if is_nc17:
                                 save_path = "Inbox/NC17-Movies"
 
-                        if re.search(r"Music", category):
+                        if "Music" in category:
                             save_name = torrent.name
-                            if re.search(r"-HHWEB|LeagueCD", torrent.name):
+                            if "-HHWEB" in torrent.name or "LeagueCD" in torrent.name:
                                 tags.append("format")
                             save_path = "Music"
                             # 对于种子名在 [] 中包含歌手名-专辑名
@@ -477,16 +477,8 @@ def main(src_dir=""):
                         configs = {}
                         if query_flag:
                             if tmdb_name:
-                                year = re.search(r"\s\((\d{4})\)\s", tmdb_name).group(1)
-                            for (
-                                start_year,
-                                end_year,
-                            ), settings in CATEGORY_SETTINGS_MAPPING[category]:
-                                if (start_year is None or start_year <= int(year)) and (
-                                    end_year is None or int(year) <= end_year
-                                ):
-                                    configs = settings
-                                    break
+                                year = TMDB_NAME_YEAR_RE.search(tmdb_name).group(1)
+                            configs = get_category_settings(category, year)
                         else:
                             configs = CATEGORY_SETTINGS_MAPPING[category][-1][1]
                         if not configs:
@@ -512,8 +504,6 @@ def main(src_dir=""):
                         else:
                             src_path = torrent.content_path
 
-                        src_path = src_path.replace("$", r"\$")
-
                         # 如果是单文件
                         if os.path.isfile(src_path):
                             files_from_file = None
@@ -558,8 +548,15 @@ def main(src_dir=""):
                             )
                         else:
                             # check the target folder after copying
+                            # 只列出顶层条目即可判断是否为空, 无需递归列出整个目录
                             rslt = subprocess.run(
-                                ["rclone", "ls", f"{google_drive_save_path}"],
+                                [
+                                    "rclone",
+                                    "lsf",
+                                    "--max-depth",
+                                    "1",
+                                    f"{google_drive_save_path}",
+                                ],
                                 encoding="utf-8",
                                 capture_output=True,
                             )
@@ -573,7 +570,7 @@ def main(src_dir=""):
                                 continue
                             else:
                                 # delete sample foler
-                                if "Sample" in rslt.stdout:
+                                if "Sample/" in rslt.stdout.splitlines():
                                     logger.info(
                                         f"Deleting sample folder in {torrent.name}"
                                     )
@@ -582,11 +579,14 @@ def main(src_dir=""):
                                             "rclone",
                                             "purge",
                                             f"{google_drive_save_path}/Sample",
-                                        ]
+                                        ],
+                                        stdout=subprocess.DEVNULL,
+                                        stderr=subprocess.PIPE,
                                     )
                                     if rslt.returncode:
                                         logger.error(
-                                            f"Deleting sample folder in {google_drive_save_path} failed"
+                                            f"Deleting sample folder in {google_drive_save_path} failed: "
+                                            f"{rslt.stderr.decode('utf-8', errors='replace').strip()}"
                                         )
                                         send_tg_msg(
                                             chat_id=TG_CHAT_ID,
@@ -628,7 +628,7 @@ def main(src_dir=""):
                         media_type = "tv"
                         # tvshows handle if get tmdb_name successfully
                         if (
-                            re.search(r"TVShows|Anime", category)
+                            ("TVShows" in category or "Anime" in category)
                             and tmdb_name
                             and "manual" not in tags
                         ):
@@ -710,8 +710,7 @@ def main(src_dir=""):
                             )
 
                         # 持久化
-                        with open(media_info_file_path, "wb") as f:
-                            pickle.dump(media_info, f)
+                        dump_pickle(media_info, media_info_file_path)
 
                 else:
                     # torrent is in inappropiate state
@@ -1,3 +1,5 @@
+from time import sleep
+
 from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.jobstores.memory import MemoryJobStore
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -19,12 +21,39 @@ class Scheduler(metaclass=Singleton):
     def start(self):
         self.scheduler.start()
 
-    def shutdown(self):
-        self.scheduler.shutdown()
+    def shutdown(self, wait=True):
+        self.scheduler.shutdown(wait=wait)
+
+    def wait_for_jobs(self, interval=5):
+        """等待所有任务执行完毕后关闭调度器"""
+        while self.scheduler.get_jobs():
+            sleep(interval)
+        # 任务开始执行时即从 jobstore 中移除, 由 shutdown 等待执行中的任务结束
+        self.shutdown(wait=True)
 
     def add_jobstore(self, jobstore, alias, **kwargs):
         self.jobstores.update({alias: jobstore})
         self.scheduler.add_jobstore(jobstore, alias=alias, **kwargs)
 
+    def enable_persistence(self, url="sqlite:///jobs.sql", alias="sqlite"):
+        """添加持久化 jobstore, 仅在需要时调用, 已添加则跳过"""
+        if alias in self.jobstores:
+            return
+        # sqlalchemy 较重, 仅在启用持久化时导入
+        from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+        from sqlalchemy import create_engine, event
+
+        engine = create_engine(url)
+        if engine.dialect.name == "sqlite":
+
+            @event.listens_for(engine, "connect")
+            def _set_sqlite_pragma(dbapi_connection, connection_record):
+                cursor = dbapi_connection.cursor()
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+                cursor.close()
+
+        self.add_jobstore(SQLAlchemyJobStore(engine=engine), alias=alias)
+
     def add_job(self, *args, **kwargs):
         self.scheduler.add_job(*args, **kwargs)
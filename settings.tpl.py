@@ -131,19 +131,21 @@ CATEGORY_SETTINGS_MAPPING = {
 # 媒体处理设置
 ORIGIN_NAME = True
 # 媒体后缀
-MEDIA_SUFFIX = [
-    "srt",
-    "ass",
-    "ssa",
-    "sup",
-    "mkv",
-    "ts",
-    "mp4",
-    "flv",
-    "rmvb",
-    "avi",
-    "mov",
-]
+MEDIA_SUFFIX = frozenset(
+    {
+        "srt",
+        "ass",
+        "ssa",
+        "sup",
+        "mkv",
+        "ts",
+        "mp4",
+        "flv",
+        "rmvb",
+        "avi",
+        "mov",
+    }
+)
 
 # plex 设置
 PLEX_BASE_URL = "https://xxxxxxxxxx"
@@ -1,6 +1,7 @@
 #!/usr/local/bin/env python
 
 import datetime
+import time
 
 from log import logger
 from settings import LOG_LEVEL, TMDB_API_KEY
@@ -9,6 +10,11 @@ from utils import is_filename_length_gt_255
 
 
 class TMDB:
+    # get_info_from_tmdb_by_id 结果缓存, 同一剧集的多个文件无需重复请求
+    # key: (is_movie, language, tmdb_id), value: (过期时间, 结果)
+    _info_cache = {}
+    info_cache_ttl = 3600
+
     def __init__(
         self,
         api_key: str = TMDB_API_KEY,
@@ -127,6 +133,10 @@ class TMDB:
         """Get movies/shows' details using tmdb_id"""
         tmdb_name = ""
         self.tmdb_id = tmdb_id
+        cache_key = (self.is_movie, self.tmdb.language, str(tmdb_id))
+        cached = self._info_cache.get(cache_key)
+        if cached and cached[0] > time.monotonic():
+            return dict(cached[1])
         details = self.tmdb_media.details(self.tmdb_id)
         date = details.release_date if self.is_movie else details.first_air_date
         date_list = date.split("-")
@@ -165,13 +175,19 @@ class TMDB:
             if is_filename_length_gt_255(tmdb_name):
                 tmdb_name = f"{original_title} ({year}) {{tmdb-{self.tmdb_id}}}"
 
-        return {
+        info = {
             "tmdb_name": tmdb_name.replace("/", "／"),
             "title": title,
             "year": year,
             "month": month,
             "country": contries,
         }
+        now = time.monotonic()
+        # 写入时顺带清理过期条目，避免常驻进程中缓存无限增长
+        for key in [k for k, v in self._info_cache.items() if v[0] <= now]:
+            del self._info_cache[key]
+        self._info_cache[cache_key] = (now + self.info_cache_ttl, info)
+        return dict(info)
 
     def get_movie_certification(self) -> bool:
         """Get movie's certifacation"""
@@ -2,16 +2,18 @@
 
 import json
 import os
+import pickle
 import re
 import shutil
 import threading
-from copy import deepcopy
 from pathlib import Path
-from typing import Union
+from typing import Optional, Union
 
 import requests
 from log import logger
-from settings import MEDIA_SUFFIX, TG_API_KEY
+from requests.adapters import HTTPAdapter
+from settings import CATEGORY_SETTINGS_MAPPING, MEDIA_SUFFIX, TG_API_KEY
+from urllib3.util.retry import Retry
 
 
 def load_json(path):
@@ -20,8 +22,98 @@ def load_json(path):
 
 
 def dump_json(obj, path):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=4, separators=(",", ": "))
+    data = json.dumps(obj, ensure_ascii=False, indent=4, separators=(",", ": "))
+    # 内容未变化时跳过写入
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == data:
+                return
+    except FileNotFoundError:
+        pass
+    # 先写入临时文件再替换，保证写入的原子性
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def load_pickle(path, default=None):
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def dump_pickle(obj, path):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    # 内容未变化时跳过写入
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return
+    except FileNotFoundError:
+        pass
+    # 先写入临时文件再替换，保证写入的原子性
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# HTTP
+# (连接超时, 读取超时)
+HTTP_TIMEOUT = (3.05, 30)
+# 实际访问的主机很少 (Emby / Telegram), 但扫描任务会在调度器线程池中并发请求同一主机
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = 16
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """请求未指定 timeout 时使用默认超时"""
+
+    def __init__(self, *args, timeout=HTTP_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+_http_session = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session() -> requests.Session:
+    """获取共享的 requests.Session, 复用连接, 并对幂等请求自动重试"""
+    global _http_session
+    if _http_session is not None:
+        return _http_session
+    # 调度器线程可能同时首次调用, 加锁避免重复创建
+    with _http_session_lock:
+        if _http_session is not None:
+            return _http_session
+        retry = Retry(
+            total=3,
+            backoff_factor=0.3,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+            respect_retry_after_header=True,
+            # 重试耗尽后返回最后一次响应, 交由调用方按状态码处理
+            raise_on_status=False,
+        )
+        adapter = TimeoutHTTPAdapter(
+            max_retries=retry,
+            pool_connections=HTTP_POOL_CONNECTIONS,
+            pool_maxsize=HTTP_POOL_MAXSIZE,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _http_session = session
+        return _http_session
 
 
 # BOT
@@ -36,7 +128,7 @@ def send_tg_msg(chat_id, text, parse_mode="markdownv2"):
         try_send = 1
         while try_send <= 3:
             try:
-                requests.post(TG_BOT_MSG, data=payload)
+                get_http_session().post(TG_BOT_MSG, data=payload)
             except Exception as e:
                 try_send += 1
                 logger.error(f"Send notification failed due to {e}")
@@ -49,7 +141,7 @@ def send_tg_msg(chat_id, text, parse_mode="markdownv2"):
             try_send = 1
             while try_send <= 3:
                 try:
-                    requests.post(TG_BOT_MSG, data=payload)
+                    get_http_session().post(TG_BOT_MSG, data=payload)
                 except Exception as e:
                     try_send += 1
                     logger.error(f"Send notification failed due to {e}")
@@ -105,9 +197,15 @@ def remove_empty_folder(
 
 
 def is_filename_length_gt_255(filename):
-    if len(filename.encode("utf-8")) > 255:
+    # utf-8 编码后字节数不小于字符数, 且纯 ASCII 时两者相等, 多数情况下无需编码
+    if len(filename) > 255:
         return True
-    return False
+    if filename.isascii():
+        return False
+    return len(filename.encode("utf-8")) > 255
+
+
+KEYWORD_TAG_RE = re.compile(r"([TYOS])-?\d+")
 
 
 def sumarize_tags(ori_tags: list[str], new_tags: list[str]) -> list[str]:
@@ -116,18 +214,22 @@ def sumarize_tags(ori_tags: list[str], new_tags: list[str]) -> list[str]:
     1. 取并集
     2. 相同类型取新 tag，可能类型有 Y(年份) / T(TMDB ID) / O(offset) / S(季)
     """
-    tags = deepcopy(ori_tags)
+    # 新 tag 中出现的关键字类型
+    new_types = set()
     for tag in new_tags:
         # 匹配关键字 tag
-        match = re.match(r"([TYOS])-?\d+", tag)
+        match = KEYWORD_TAG_RE.match(tag)
         if match:
             # 获取 tag 类型
-            _type = match.group(1)
-            for _ in ori_tags:
-                if _.startswith(_type):
-                    logger.info(f"Removing tag {_}")
-                    tags.remove(_)
-    return list(set(tags).union(new_tags))
+            new_types.add(match.group(1))
+    new_types = tuple(new_types)
+    tags = set()
+    for tag in ori_tags:
+        if new_types and tag.startswith(new_types):
+            logger.info(f"Removing tag {tag}")
+            continue
+        tags.add(tag)
+    return list(tags.union(new_tags))
 
 
 def remove_original_title_from_file(path: str) -> None:
@@ -146,10 +248,12 @@ def remove_original_title_from_file(path: str) -> None:
 def iterdir_recursive(path: Union[str, Path]) -> list[Path]:
     """递归获取指定路径下所有文件"""
     files = []
-    for p in Path(path).iterdir():
-        if p.is_dir():
-            files.extend(iterdir_recursive(p))
-        files.append(p)
+    # scandir 直接返回文件类型, 不必对每个条目再 stat 一次
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_dir():
+                files.extend(iterdir_recursive(entry.path))
+            files.append(Path(entry.path))
     return files
 
 
@@ -159,7 +263,7 @@ def remove_folder_contains_no_media(path):
             continue
         remove_flag = True
         for file in iterdir_recursive(dir.absolute()):
-            suffix = file.name.split(".")[-1]
+            suffix = file.name.rpartition(".")[2]
             if suffix in MEDIA_SUFFIX:
                 logger.info(f"file {file.name} is media, skip...")
                 remove_flag = False
@@ -177,3 +281,15 @@ class Singleton(type):
             if not hasattr(cls, "_instance"):
                 cls._instance = super().__call__(*args, **kwds)
         return cls._instance
+
+
+def get_category_settings(category: str, year: Optional[int]) -> dict:
+    """根据分类和年份获取对应的配置, 按配置顺序取第一个匹配的区间, 未匹配时返回空字典"""
+    for (start_year, end_year), settings in CATEGORY_SETTINGS_MAPPING.get(category, []):
+        # 仅在区间有边界时才需要年份, year 为 None 时只能匹配 (None, None)
+        if start_year is not None and (year is None or int(year) < start_year):
+            continue
+        if end_year is not None and (year is None or int(year) > end_year):
+            continue
+        return settings
+    return {}